@@ -1,27 +1,76 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort
+from flask import Flask, request, redirect, jsonify, abort, g, has_request_context
+from flask.json.provider import JSONProvider, DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect as sa_inspect, select, update, delete, func, event, and_, or_, lambda_stmt
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session, selectinload, undefer, make_transient_to_detached
 from flask_login import (
     LoginManager, UserMixin, login_user,
     logout_user, login_required, current_user
 )
 from flask_bcrypt import Bcrypt
-from apscheduler.schedulers.background import BackgroundScheduler
-from functools import wraps
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from datetime import datetime
-import atexit, os, random
+import os, sys, hashlib, json, math, secrets
+import redis
+import orjson
+import numpy as np
 from datetime import time
-from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
+from time import monotonic, time as unix_time
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, SQLALCHEMY_ENGINE_OPTIONS, REDIS_URL, SQL_QUERY_BUDGET, TRUSTED_PROXY_HOPS
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 
+# Dates are passed through to Flask's own conversion (HTTP-date strings) and
+# non-str dict keys are stringified, matching DefaultJSONProvider
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+class OrjsonProvider(JSONProvider):
+    # orjson parses request bodies and serializes jsonify() payloads several
+    # times faster than the stdlib json module; types it doesn't know (Decimal,
+    # dates, dataclasses) go through DefaultJSONProvider.default. Unlike the
+    # default provider, response keys keep insertion order instead of sorting.
+    def dumps(self, obj, **kwargs):
+        # Formatting arguments (sort_keys, indent, separators from e.g. the
+        # session serializer) need the stdlib encoder to be honoured
+        if kwargs:
+            kwargs.setdefault("default", DefaultJSONProvider.default)
+            return json.dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=DefaultJSONProvider.default,
+                            option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS),
+            mimetype="application/json"
+        )
+
 app = Flask(__name__)
+if TRUSTED_PROXY_HOPS:
+    # Trust only as many X-Forwarded-* entries as there are proxies we run, so
+    # request.remote_addr is the real client and can't be spoofed past them
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+app.json = OrjsonProvider(app)
+# "/api/stocks/" should match "/api/stocks" instead of costing a 308 round trip
+app.url_map.strict_slashes = False
 load_dotenv()
 
-CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "http://localhost:5173"}})
+FRONTEND_ORIGIN = "http://localhost:5173"
+LOGIN_URL = f"{FRONTEND_ORIGIN}/login"
+
+CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": FRONTEND_ORIGIN}})
 
 # ---------------- Configuration ---------------- #
+PRICE_UPDATE_INTERVAL = 10  # seconds between price_updater.py ticks
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLALCHEMY_ENGINE_OPTIONS
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
 
 app.config.update(
@@ -32,30 +81,47 @@ app.config.update(
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
 
 # ---------------- Flask-Login setup ---------------- #
 login_manager = LoginManager()
 login_manager.init_app(app)
-login_manager.login_view = "login"
 
 @login_manager.unauthorized_handler
 def api_unauthorized():
     # If it's an API request, return JSON instead of redirecting to /login
     if request.path.startswith("/api/"):
         return jsonify({"error": "UNAUTHORIZED"}), 401
-    return redirect(url_for("login"))
+    # The login page lives in the React app, not in a Flask view
+    return redirect(LOGIN_URL)
 
 # ---------------- MODELS ---------------- #
+class Role:
+    CUSTOMER = "customer"
+    ADMIN = "admin"
+
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.CheckConstraint("funds >= 0", name="ck_user_funds_nonneg"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    full_name = db.Column(db.String(250), nullable=False)
+    # Deferred: only profile/registration and the login check read these, so
+    # session loads and refreshes never pull them (undefer where needed)
+    full_name = db.deferred(db.Column(db.String(250), nullable=False))
     name = db.Column(db.String(100), nullable=False, unique=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(250), nullable=False)
-    role = db.Column(db.String(50), default="customer", nullable=False)
-    funds = db.Column(db.Float, default=0.0)
-
-    portfolio = db.relationship("Portfolio", backref="user", lazy=True)
+    password = db.deferred(db.Column(db.String(250), nullable=False))
+    role = db.Column(db.String(50), default=Role.CUSTOMER, nullable=False, index=True)
+    # Exact DECIMAL in MySQL; asdecimal=False keeps Python-side values as float
+    funds = db.Column(db.Numeric(14, 2, asdecimal=False), default=0.0, nullable=False)
+
+    # Collections are never walked from the user row; list endpoints query the
+    # child tables directly. "raise" turns an accidental N+1 into an error.
+    portfolio = db.relationship("Portfolio", back_populates="user", lazy="raise")
+    transactions = db.relationship("FinancialTransaction", back_populates="user", lazy="raise")
+    payment_methods = db.relationship("PaymentMethod", back_populates="user", lazy="raise")
+    orders = db.relationship("TradeOrder", back_populates="user", lazy="raise")
 
 class Stock(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -65,13 +131,30 @@ class Stock(db.Model):
     volume = db.Column(db.Float, nullable=False)
 
 class Portfolio(db.Model):
+    # One row per (user, stock); also serves as the index for position lookups
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "stock_id", name="uq_portfolio_user_stock"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     stock_id = db.Column(db.Integer, db.ForeignKey("stock.id"), nullable=False)
     quantity = db.Column(db.Float, default=0.0)
+    user = db.relationship("User", back_populates="portfolio")
     stock = db.relationship("Stock")
 
 class FinancialTransaction(db.Model):
+    # Matches filter_by(user_id).order_by(created_at desc): the user's rows are
+    # read in index order (InnoDB scans it backwards) with no filesort. The
+    # trailing columns (plus the implicit primary key) make it covering for
+    # the /api/funds history, so that query never touches the clustered rows.
+    __table_args__ = (
+        db.Index(
+            "ix_financial_transaction_user_history",
+            "user_id", "created_at", "type", "amount", "balance_after", "note",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     type = db.Column(db.String(20), nullable=False)
@@ -79,9 +162,15 @@ class FinancialTransaction(db.Model):
     balance_after = db.Column(db.Float, nullable=False)
     note = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
-    user = db.relationship("User", backref=db.backref("transactions", lazy=True))
+    user = db.relationship("User", back_populates="transactions")
 
 class PaymentMethod(db.Model):
+    # Covers both the default-method lookup on deposit and the
+    # (is_default desc, created_at desc) listing on /api/funds
+    __table_args__ = (
+        db.Index("ix_payment_method_user_default", "user_id", "is_default", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     brand = db.Column(db.String(20), nullable=False)
@@ -91,7 +180,7 @@ class PaymentMethod(db.Model):
     is_default = db.Column(db.Boolean, default=True)
     token = db.Column(db.String(64))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
-    user = db.relationship("User", backref=db.backref("payment_methods", lazy=True))
+    user = db.relationship("User", back_populates="payment_methods")
 
 class MarketSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -113,8 +202,14 @@ class OrderSide:
     SELL = "SELL"
 
 class TradeOrder(db.Model):
+    # Serves the per-user order history sorted by created_at; its user_id
+    # prefix also covers the foreign key, so no separate user_id index
+    __table_args__ = (
+        db.Index("ix_trade_order_user_created", "user_id", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     stock_id = db.Column(db.Integer, db.ForeignKey("stock.id"), nullable=False, index=True)
     side = db.Column(db.String(4), nullable=False) 
     quantity = db.Column(db.Float, nullable=False)
@@ -124,7 +219,7 @@ class TradeOrder(db.Model):
     executed_at = db.Column(db.DateTime)
     canceled_at = db.Column(db.DateTime)
 
-    user = db.relationship("User", backref=db.backref("orders", lazy=True))
+    user = db.relationship("User", back_populates="orders")
     stock = db.relationship("Stock")
 
 # ---------------- Helpers ---------------- #
@@ -139,23 +234,85 @@ def record_txn(user_id: int, txn_type: str, amount: float, balance_after: float,
     )
     db.session.add(t)
 
-def customer_required(view_func):
-    @wraps(view_func)
-    @login_required
-    def wrapped(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != "customer":
-            abort(403)
-        return view_func(*args, **kwargs)
-    return wrapped
-
-def admin_required(view_func):
-    @wraps(view_func)
-    @login_required
-    def wrapped(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != "admin":
-            abort(403)
-        return view_func(*args, **kwargs)
-    return wrapped
+# --- password hashing --- #
+# Argon2id at the m=19MiB, t=2, p=1 profile. Accounts created before the switch
+# still hold bcrypt hashes ("$2b$..."); those verify through bcrypt and are
+# upgraded to Argon2 on the next successful login.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19 * 1024, parallelism=1)
+
+def _off_hub(fn, *args):
+    # Hashing is CPU-bound. Under gunicorn's gevent workers it would stall every
+    # greenlet in the process, so hand it to gevent's native threadpool;
+    # argon2-cffi and bcrypt release the GIL while they hash.
+    if "gevent" in sys.modules:
+        import gevent
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+def _argon2_matches(hashed: str, password: str) -> bool:
+    try:
+        return password_hasher.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def hash_password(password: str) -> str:
+    return _off_hub(password_hasher.hash, password)
+
+def check_password(user: User, password: str) -> bool:
+    if user.password.startswith("$2"):
+        if not _off_hub(bcrypt.check_password_hash, user.password, password):
+            return False
+    else:
+        if not _off_hub(_argon2_matches, user.password, password):
+            return False
+        if not password_hasher.check_needs_rehash(user.password):
+            return True
+
+    user.password = hash_password(password)
+    db.session.commit()
+    return True
+
+# Checked against when the email is unknown, so a failed login costs the same
+# Argon2 work whether or not the account exists (no user-enumeration timing)
+_DUMMY_HASH = password_hasher.hash(secrets.token_hex(16))
+
+def burn_password_check(password: str):
+    _off_hub(_argon2_matches, _DUMMY_HASH, password)
+
+# --- login rate limit --- #
+# Fixed one-second windows per client IP; shared through Redis when configured,
+# otherwise counted per process. Caps how much hashing CPU one client can burn.
+LOGIN_ATTEMPTS_PER_SECOND = 5
+_login_window = {"second": 0, "counts": {}}
+
+def login_rate_limited(client_ip: str) -> bool:
+    second = int(unix_time())
+    if redis_client is not None:
+        key = f"login_rate:{client_ip}:{second}"
+        try:
+            attempts = redis_client.incr(key)
+            if attempts == 1:
+                redis_client.expire(key, 2)
+            return attempts > LOGIN_ATTEMPTS_PER_SECOND
+        except redis.RedisError:
+            pass  # fall back to the per-process window
+
+    if _login_window["second"] != second:
+        _login_window.update(second=second, counts={})
+    counts = _login_window["counts"]
+    counts[client_ip] = counts.get(client_ip, 0) + 1
+    return counts[client_ip] > LOGIN_ATTEMPTS_PER_SECOND
+
+# Tags the view with the role allowed to call it; enforce_endpoint_role()
+# checks it once per request. The tag travels with the function, so it is
+# found whatever endpoint name (endpoint=, blueprint prefix) it is routed under.
+def role_required(role: str):
+    def decorator(view_func):
+        view_func.required_role = role
+        return view_func
+    return decorator
 
 # --- order helpers --- #
 def place_order(user: User, stock: Stock, side: str, qty: float) -> TradeOrder:
@@ -173,18 +330,99 @@ def place_order(user: User, stock: Stock, side: str, qty: float) -> TradeOrder:
     db.session.commit()
     return order
 
-def _add_or_update_position(user_id: int, stock: Stock, qty_delta: float):
-    holding = Portfolio.query.filter_by(user_id=user_id, stock_id=stock.id).first()
-    if holding:
-        holding.quantity = round(holding.quantity + qty_delta, 6)
-        if holding.quantity <= 0:
-            db.session.delete(holding)
-    else:
-        if qty_delta > 0:
-            db.session.add(Portfolio(user_id=user_id, stock_id=stock.id, quantity=qty_delta))
+def _add_position(user_id: int, stock_id: int, qty: float):
+    # Single upsert on uq_portfolio_user_stock instead of SELECT + INSERT/UPDATE
+    stmt = mysql_insert(Portfolio).values(user_id=user_id, stock_id=stock_id, quantity=qty)
+    db.session.execute(stmt.on_duplicate_key_update(
+        quantity=func.round(Portfolio.quantity + stmt.inserted.quantity, 6)
+    ))
+
+# --- atomic balance updates --- #
+# Each guard is evaluated by the database inside the UPDATE itself, so two
+# concurrent requests can never both pass a funds/volume/quantity check.
+_NO_SYNC = {"synchronize_session": False}
+
+# Largest balance User.funds (DECIMAL(14, 2)) can hold; MySQL strict mode
+# rejects anything above it with an out-of-range error
+MAX_FUNDS = 999_999_999_999.99
+
+def _debit_funds(user: User, amount: float) -> bool:
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user.id, User.funds >= amount)
+        .values(funds=func.round(User.funds - amount, 2)),
+        execution_options=_NO_SYNC
+    )
+    if result.rowcount != 1:
+        return False
+    db.session.refresh(user, ["funds"])
+    return True
+
+def _credit_funds(user: User, amount: float) -> bool:
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user.id, func.coalesce(User.funds, 0) <= MAX_FUNDS - amount)
+        .values(funds=func.round(func.coalesce(User.funds, 0) + amount, 2)),
+        execution_options=_NO_SYNC
+    )
+    if result.rowcount != 1:
+        return False
+    db.session.refresh(user, ["funds"])
+    return True
+
+def _take_volume(stock: Stock, qty: float) -> bool:
+    result = db.session.execute(
+        update(Stock)
+        .where(Stock.id == stock.id, Stock.volume >= qty)
+        .values(volume=func.round(Stock.volume - qty, 6)),
+        execution_options=_NO_SYNC
+    )
+    db.session.expire(stock, ["volume"])
+    return result.rowcount == 1
+
+def _return_volume(stock: Stock, qty: float):
+    db.session.execute(
+        update(Stock)
+        .where(Stock.id == stock.id)
+        .values(volume=func.round(Stock.volume + qty, 6)),
+        execution_options=_NO_SYNC
+    )
+    db.session.expire(stock, ["volume"])
+
+def _reduce_position(user_id: int, stock_id: int, qty: float) -> bool:
+    result = db.session.execute(
+        update(Portfolio)
+        .where(Portfolio.user_id == user_id,
+               Portfolio.stock_id == stock_id,
+               Portfolio.quantity >= qty)
+        .values(quantity=func.round(Portfolio.quantity - qty, 6)),
+        execution_options=_NO_SYNC
+    )
+    if result.rowcount != 1:
+        return False
+    db.session.execute(
+        delete(Portfolio)
+        .where(Portfolio.user_id == user_id,
+               Portfolio.stock_id == stock_id,
+               Portfolio.quantity <= 0),
+        execution_options=_NO_SYNC
+    )
+    return True
+
+def _transition_order(order: TradeOrder, status: str, **stamps) -> bool:
+    # PENDING -> status as one guarded UPDATE, so of two racing execute/cancel
+    # requests exactly one wins and the other sees rowcount 0
+    result = db.session.execute(
+        update(TradeOrder)
+        .where(TradeOrder.id == order.id, TradeOrder.status == OrderStatus.PENDING)
+        .values(status=status, **stamps),
+        execution_options=_NO_SYNC
+    )
+    db.session.expire(order, ["status", *stamps])
+    return result.rowcount == 1
 
 def execute_order(order_id: int):
-    order = TradeOrder.query.get_or_404(order_id)
+    order = db.get_or_404(TradeOrder, order_id)
     if order.status != OrderStatus.PENDING:
         return False, "Order is not pending."
 
@@ -192,74 +430,295 @@ def execute_order(order_id: int):
     stock = order.stock
     qty = float(order.quantity)
     total = round(order.price_locked * qty, 2)
+    side = order.side
+    note = f"{side} {qty} {stock.symbol} @ ${order.price_locked:.2f}"
+    if not math.isfinite(total) or total > MAX_FUNDS:
+        return False, "Order total is too large."
+
+    # Everything below runs in one transaction. Rows are always locked in the
+    # same order (order, stock, user, holding) for buys and sells alike, so
+    # concurrent trades queue on the row locks instead of deadlocking.
+    if not _transition_order(order, OrderStatus.EXECUTED, executed_at=datetime.now()):
+        db.session.rollback()
+        return False, "Order is not pending."
 
-    if order.side == OrderSide.BUY:
-        if stock.volume < qty:
+    if side == OrderSide.BUY:
+        if not _take_volume(stock, qty):
+            db.session.rollback()
             return False, "Insufficient market volume."
-        if user.funds < total:
+        if not _debit_funds(user, total):
+            db.session.rollback()
             return False, "Insufficient funds."
-
-        user.funds = round(user.funds - total, 2)
-        stock.volume = round(stock.volume - qty, 6)
-        _add_or_update_position(user.id, stock, +qty)
-        record_txn(user.id, "BUY", total, user.funds,
-                   note=f"BUY {qty} {stock.symbol} @ ${order.price_locked:.2f}")
+        _add_position(user.id, stock.id, qty)
     else: 
-        holding = Portfolio.query.filter_by(user_id=user.id, stock_id=stock.id).first()
-        if not holding or holding.quantity < qty:
+        _return_volume(stock, qty)
+        if not _credit_funds(user, total):
+            db.session.rollback()
+            return False, "Balance limit exceeded."
+        if not _reduce_position(user.id, stock.id, qty):
+            db.session.rollback()
             return False, "Not enough shares to sell."
 
-        holding.quantity = round(holding.quantity - qty, 6)
-        stock.volume = round(stock.volume + qty, 6)
-        user.funds = round(user.funds + total, 2)
-        if holding.quantity <= 0:
-            db.session.delete(holding)
-        record_txn(user.id, "SELL", total, user.funds,
-                   note=f"SELL {qty} {stock.symbol} @ ${order.price_locked:.2f}")
-
-    order.status = OrderStatus.EXECUTED
-    order.executed_at = datetime.now()
+    record_txn(user.id, side, total, user.funds, note=note)
     db.session.commit()
+    refresh_stocks_cache()
     return True, "Order executed."
 
 def cancel_order(order_id: int):
-    order = TradeOrder.query.get_or_404(order_id)
-    if order.status != OrderStatus.PENDING:
+    order = db.get_or_404(TradeOrder, order_id)
+    if not _transition_order(order, OrderStatus.CANCELED, canceled_at=datetime.now()):
+        db.session.rollback()
         return False, "Only pending orders can be canceled."
-    order.status = OrderStatus.CANCELED
-    order.canceled_at = datetime.now()
     db.session.commit()
     return True, "Order canceled."
 
+# --- stock list cache --- #
+# Prices only move on the scheduler tick, so the listing endpoints can share
+# one snapshot instead of querying the table on every request. With REDIS_URL
+# set the snapshot lives in Redis, so every gunicorn worker and the
+# price_updater process see the same copy and the same invalidations;
+# otherwise each process keeps its own TTL-bounded copy.
+STOCKS_CACHE_TTL = PRICE_UPDATE_INTERVAL
+STOCKS_CACHE_KEY = "stocks:v1"
+_stocks_cache = {"rows": None, "etag": None, "ts": 0.0}
+
+def _load_stocks():
+    # Plain column rows: nothing here is mutated, so skip ORM hydration
+    rows = [
+        row._asdict() for row in db.session.execute(
+            select(Stock.id, Stock.company_name, Stock.symbol, Stock.price, Stock.volume)
+        )
+    ]
+    return rows, hashlib.sha1(repr(rows).encode()).hexdigest()
+
+def _store_stocks_in_redis(rows, etag, nx=False):
+    redis_client.set(STOCKS_CACHE_KEY, json.dumps({"rows": rows, "etag": etag}),
+                     ex=STOCKS_CACHE_TTL, nx=nx)
+
+def _get_stocks_from_redis():
+    try:
+        cached = redis_client.get(STOCKS_CACHE_KEY)
+        if cached:
+            payload = json.loads(cached)
+            return payload["rows"], payload["etag"]
+        rows, etag = _load_stocks()
+        # NX: a snapshot a writer published after our SELECT must win over ours
+        _store_stocks_in_redis(rows, etag, nx=True)
+        return rows, etag
+    except redis.RedisError:
+        # Cache outage degrades to a direct read, never to a failed request
+        return _load_stocks()
+
+def get_stocks_cached():
+    # Returns (rows, etag); the etag changes whenever any listed value does
+    if redis_client is not None:
+        return _get_stocks_from_redis()
+
+    rows, etag = _stocks_cache["rows"], _stocks_cache["etag"]
+    if rows is None or monotonic() - _stocks_cache["ts"] > STOCKS_CACHE_TTL:
+        rows, etag = _load_stocks()
+        _stocks_cache.update(rows=rows, etag=etag, ts=monotonic())
+    return rows, etag
+
+def stocks_response():
+    rows, etag = get_stocks_cached()
+    # The client polls this every few seconds; revalidating with the etag
+    # turns an unchanged listing into an empty 304.
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(rows)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def refresh_stocks_cache():
+    # Call after committing a change to the listing (price tick, trade, admin
+    # edit). Writes the new snapshot through instead of deleting the key, so a
+    # reader still holding a pre-commit SELECT can't repopulate it with old rows.
+    _stocks_cache["rows"] = None
+    if redis_client is None:
+        return
+    try:
+        _store_stocks_in_redis(*_load_stocks())
+    except redis.RedisError:
+        pass  # the old snapshot still expires after STOCKS_CACHE_TTL
+
 def get_json():
     data = request.get_json(silent=True)
     if data is None:
         return {}
     return data
 
+def parse_number(value, type_=float):
+    # None for missing/malformed input; also rejects NaN/inf, which float()
+    # accepts and which would slip past "<= 0" checks
+    try:
+        number = type_(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return number
+
+# --- keyset pagination --- #
+ORDERS_PAGE_SIZE = 50
+
+def make_cursor(created_at: datetime, row_id: int) -> str:
+    return f"{created_at.isoformat()}_{row_id}"
+
+def parse_cursor(cursor: str):
+    # "<iso created_at>_<id>" -> (datetime, int), or None if malformed
+    created_at, _, row_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        return None
+
+@app.before_request
+def enforce_endpoint_role():
+    role = getattr(app.view_functions.get(request.endpoint), "required_role", None)
+    # CORS preflights carry no session cookie; let flask-cors answer them
+    if role is None or request.method == "OPTIONS":
+        return None
+    if not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    if current_user.role != role:
+        abort(403)
+    return None
+
 # ---------------- Create tables ---------------- #
+def _check_portfolio_key():
+    # _add_position relies on ON DUPLICATE KEY; without the unique key every
+    # repeat buy would insert a second holding row and break later sells
+    inspector = sa_inspect(db.engine)
+    keys = [c["column_names"] for c in inspector.get_unique_constraints("portfolio")]
+    keys += [i["column_names"] for i in inspector.get_indexes("portfolio") if i["unique"]]
+    if not any(set(cols) == {"user_id", "stock_id"} for cols in keys):
+        raise RuntimeError(
+            "portfolio is missing uq_portfolio_user_stock; "
+            "apply backend/migrations/001_trading_schema.sql"
+        )
+
 with app.app_context():
     db.create_all()
+    _check_portfolio_key()
+
+# ---------------- Query budget (development) ---------------- #
+# With SQL_QUERY_BUDGET set, every response reports how many SQL statements it
+# ran (X-Query-Count) and requests over budget are logged, so a new N+1 loop
+# shows up during development instead of in production.
+if SQL_QUERY_BUDGET > 0:
+    with app.app_context():
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count_query(*_):
+            if has_request_context():
+                g.query_count = g.get("query_count", 0) + 1
+
+    @app.after_request
+    def report_query_count(response):
+        count = g.get("query_count", 0)
+        response.headers["X-Query-Count"] = str(count)
+        if count > SQL_QUERY_BUDGET:
+            app.logger.warning("%s %s ran %d queries (budget %d)",
+                               request.method, request.path, count, SQL_QUERY_BUDGET)
+        return response
 
 # ---------------- Flask-Login user loader ---------------- #
+# With Redis configured, the user's identity columns are cached so the loader
+# can skip the SELECT; funds is not cached (a racing fill could restore a stale
+# balance) and loads on its own when a route reads it.
+USER_CACHE_TTL = 300  # seconds
+
+def _user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def cache_user(user: User):
+    if redis_client is None:
+        return
+    key = _user_cache_key(user.id)
+    try:
+        redis_client.hset(key, mapping={
+            "name": user.name,
+            "email": user.email,
+            "role": user.role,
+        })
+        redis_client.expire(key, USER_CACHE_TTL)
+    except redis.RedisError:
+        pass
+
+def _load_cached_user(user_id: int):
+    try:
+        cached = redis_client.hgetall(_user_cache_key(user_id))
+    except redis.RedisError:
+        return None
+    if not cached:
+        return None
+    fields = {k.decode(): v.decode() for k, v in cached.items()}
+    user = User(id=user_id, name=fields["name"], email=fields["email"],
+                role=fields["role"])
+    # Attach as a persistent row without a SELECT; columns not cached
+    # (funds, full_name, password) still lazy-load if a route touches them.
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def mark_user_stale(user_id: int):
+    db.session.info.setdefault("stale_users", set()).add(user_id)
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale_users(session):
+    stale = session.info.pop("stale_users", None)
+    if stale and redis_client is not None:
+        try:
+            redis_client.delete(*(_user_cache_key(uid) for uid in stale))
+        except redis.RedisError:
+            pass  # entries still expire after USER_CACHE_TTL
+
+@event.listens_for(Session, "after_rollback")
+def _forget_stale_users(session):
+    session.info.pop("stale_users", None)
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, user):
+    mark_user_stale(user.id)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    user_id = int(user_id)
+    if redis_client is not None:
+        user = _load_cached_user(user_id)
+        if user is not None:
+            return user
+    user = db.session.get(User, user_id)
+    if user is not None:
+        cache_user(user)
+    return user
 
 # ---------------- RANDOM PRICE GENERATOR ---------------- #
-def update_price(current_price: float, drift: float = 0.0005) -> float:
-    random_change = random.uniform(-0.01, 0.01) + drift
-    new_price = current_price * (1 + random_change)
-    return round(max(new_price, 0.01), 2)
+# Driven by price_updater.py, which runs as its own single process
+_rng = np.random.default_rng()
+
+def update_prices(prices: np.ndarray, drift: float = 0.0005) -> np.ndarray:
+    random_change = _rng.uniform(-0.01, 0.01, prices.size) + drift
+    new_prices = prices * (1 + random_change)
+    return np.maximum(new_prices, 0.01).round(2)
 
 def update_all_stock_prices():
     with app.app_context():
         if not market_is_open():
             return
 
-        for stock in Stock.query.all():
-            stock.price = update_price(float(stock.price))
+        # One executemany UPDATE keyed by primary key instead of a flush per row
+        rows = db.session.query(Stock.id, Stock.price).all()
+        if rows:
+            ids, prices = zip(*rows)
+            new_prices = update_prices(np.asarray(prices, dtype=np.float64))
+            db.session.execute(update(Stock), [
+                {"id": stock_id, "price": price}
+                for stock_id, price in zip(ids, new_prices.tolist())
+            ])
         db.session.commit()
+        refresh_stocks_cache()
 
 # ------------- MARKET SETTINGS ---------------- #
 def default_holidays_set():
@@ -355,37 +814,12 @@ def market_status():
         "now": now.strftime("%H:%M"),
     }
 
-app.jinja_env.globals.update(market_is_open=market_is_open)
-
-# scheduler
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(func=update_all_stock_prices, trigger="interval", seconds=10)
-
-def start_scheduler():
-    if app.debug:
-        if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
-            return
-    if not scheduler.running:
-        scheduler.start()
-        atexit.register(lambda: scheduler.shutdown(wait=False))
-
-start_scheduler()
-
 # ---------------- API ROUTES ---------------- #
 
 @app.route("/api/stocks", methods=["GET"])
 @login_required
 def api_stocks():
-    stocks = Stock.query.all()
-    return jsonify([
-        {
-            "id": s.id,
-            "company_name": s.company_name,
-            "symbol": s.symbol,
-            "price": s.price,
-            "volume": s.volume
-        } for s in stocks
-    ]), 200
+    return stocks_response()
 
 @app.route("/api/me", methods=["GET"])
 def api_me():
@@ -410,16 +844,16 @@ def api_register():
     email = (data.get("email") or "").strip().lower()
     password = data.get("password") or ""
 
-    role = (data.get("role") or "customer").strip().lower()
+    role = (data.get("role") or Role.CUSTOMER).strip().lower()
     admin_key = (data.get("admin_key") or "").strip()
 
     if not full_name or not username or not email or not password:
         return jsonify({"error": "MISSING_FIELDS"}), 400
 
-    if role not in {"customer", "admin"}:
+    if role not in {Role.CUSTOMER, Role.ADMIN}:
         return jsonify({"error": "INVALID_ROLE"}), 400
 
-    if role == "admin":
+    if role == Role.ADMIN:
         expected = os.getenv("ADMIN_SECRET_KEY")
         if not expected or admin_key != expected:
             return jsonify({"error": "INVALID_ADMIN_SECRET"}), 403
@@ -433,7 +867,7 @@ def api_register():
     if User.query.filter_by(name=username).first():
         return jsonify({"error": "USERNAME_EXISTS"}), 409
 
-    hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
+    hashed_password = hash_password(password)
 
     new_user = User(
         full_name=full_name,
@@ -467,8 +901,14 @@ def api_login():
     if not email or not password:
         return jsonify({"error": "MISSING_FIELDS"}), 400
 
-    user = User.query.filter_by(email=email).first()
-    if not user or not bcrypt.check_password_hash(user.password, password):
+    if login_rate_limited(request.remote_addr or ""):
+        return jsonify({"error": "TOO_MANY_ATTEMPTS"}), 429
+
+    user = User.query.options(undefer(User.password)).filter_by(email=email).first()
+    if not user:
+        burn_password_check(password)
+        return jsonify({"error": "INVALID_CREDENTIALS"}), 401
+    if not check_password(user, password):
         return jsonify({"error": "INVALID_CREDENTIALS"}), 401
 
     login_user(user)
@@ -490,7 +930,7 @@ def api_logout():
     return jsonify({"message": "LOGGED_OUT"}), 200
 
 @app.route("/api/orders", methods=["POST"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_place_order():
     data = get_json()
     side = (data.get("side") or "").upper().strip()
@@ -500,13 +940,12 @@ def api_place_order():
     if side not in {OrderSide.BUY, OrderSide.SELL}:
         return jsonify({"error": "INVALID_SIDE"}), 400
 
-    try:
-        stock_id = int(stock_id)
-        quantity = float(quantity)
-    except Exception:
+    stock_id = parse_number(stock_id, int)
+    quantity = parse_number(quantity)
+    if stock_id is None or quantity is None:
         return jsonify({"error": "INVALID_INPUT"}), 400
 
-    stock = Stock.query.get_or_404(stock_id)
+    stock = db.get_or_404(Stock, stock_id)
 
     try:
         order = place_order(current_user, stock, side, quantity)
@@ -527,12 +966,12 @@ def api_place_order():
     }), 201
 
 @app.route("/api/orders/<int:order_id>/execute", methods=["POST"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_execute_order(order_id):
     if not market_is_open():
         return jsonify({"error": "MARKET_CLOSED"}), 400
 
-    order = TradeOrder.query.get_or_404(order_id)
+    order = db.get_or_404(TradeOrder, order_id)
 
     # Only owner can execute (admin support later)
     if order.user_id != current_user.id:
@@ -545,9 +984,9 @@ def api_execute_order(order_id):
     return jsonify({"message": msg}), 200
 
 @app.route("/api/orders/<int:order_id>/cancel", methods=["POST"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_cancel_order(order_id):
-    order = TradeOrder.query.get_or_404(order_id)
+    order = db.get_or_404(TradeOrder, order_id)
 
     if order.user_id != current_user.id:
         return jsonify({"error": "FORBIDDEN"}), 403
@@ -559,37 +998,66 @@ def api_cancel_order(order_id):
     return jsonify({"message": msg}), 200
 
 @app.route("/api/orders", methods=["GET"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_get_orders():
-    orders = (TradeOrder.query
-              .filter_by(user_id=current_user.id)
-              .order_by(TradeOrder.created_at.desc())
+    # Keyset pagination on (created_at, id): each page is an index range read
+    # that starts where the previous one ended, however long the history is.
+    query = (TradeOrder.query
+             .options(selectinload(TradeOrder.stock))
+             .filter_by(user_id=current_user.id))
+
+    before = request.args.get("before")
+    if before:
+        cursor = parse_cursor(before)
+        if cursor is None:
+            return jsonify({"error": "INVALID_CURSOR"}), 400
+        created_at, order_id = cursor
+        query = query.filter(or_(
+            TradeOrder.created_at < created_at,
+            and_(TradeOrder.created_at == created_at, TradeOrder.id < order_id)
+        ))
+
+    orders = (query
+              .order_by(TradeOrder.created_at.desc(), TradeOrder.id.desc())
+              .limit(ORDERS_PAGE_SIZE + 1)
               .all())
+    next_before = None
+    if len(orders) > ORDERS_PAGE_SIZE:
+        orders = orders[:ORDERS_PAGE_SIZE]
+        next_before = make_cursor(orders[-1].created_at, orders[-1].id)
 
-    return jsonify([
-        {
-            "id": o.id,
-            "stock_id": o.stock_id,
-            "side": o.side,
-            "quantity": o.quantity,
-            "price_locked": o.price_locked,
-            "status": o.status,
-            "created_at": o.created_at.isoformat() if o.created_at else None,
-            "executed_at": o.executed_at.isoformat() if o.executed_at else None,
-            "canceled_at": o.canceled_at.isoformat() if o.canceled_at else None,
-            "symbol": o.stock.symbol,
-            "company_name": o.stock.company_name
-        } for o in orders
-    ]), 200
+    return jsonify({
+        "orders": [
+            {
+                "id": o.id,
+                "stock_id": o.stock_id,
+                "side": o.side,
+                "quantity": o.quantity,
+                "price_locked": o.price_locked,
+                "status": o.status,
+                "created_at": o.created_at.isoformat() if o.created_at else None,
+                "executed_at": o.executed_at.isoformat() if o.executed_at else None,
+                "canceled_at": o.canceled_at.isoformat() if o.canceled_at else None,
+                "symbol": o.stock.symbol,
+                "company_name": o.stock.company_name
+            } for o in orders
+        ],
+        "next_before": next_before
+    }), 200
 
 @app.route("/api/portfolio", methods=["GET"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_portfolio():
     # current user cash
     cash = round(float(current_user.funds or 0), 2)
 
-    # holdings from Portfolio table
-    holdings = Portfolio.query.filter_by(user_id=current_user.id).all()
+    # holdings joined with their stock rows in one query (no per-row lazy load)
+    holdings = (
+        db.session.query(Portfolio, Stock)
+        .join(Stock, Portfolio.stock_id == Stock.id)
+        .filter(Portfolio.user_id == current_user.id)
+        .all()
+    )
 
     # Build avg_cost using EXECUTED BUY orders
     executed_buys = (
@@ -613,8 +1081,7 @@ def api_portfolio():
     result_holdings = []
     holdings_value = 0.0
 
-    for h in holdings:
-        stock = h.stock
+    for h, stock in holdings:
         qty = float(h.quantity)
         current_price = float(stock.price)
 
@@ -655,17 +1122,30 @@ def api_portfolio():
 # ---------------- FUNDS API ---------------- #
 
 @app.route("/api/funds", methods=["GET"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_funds():
-    recent_txns = (FinancialTransaction.query
-                   .filter_by(user_id=current_user.id)
-                   .order_by(FinancialTransaction.created_at.desc())
-                   .limit(10).all())
-
-    methods = (PaymentMethod.query
-               .filter_by(user_id=current_user.id)
-               .order_by(PaymentMethod.is_default.desc(), PaymentMethod.created_at.desc())
-               .all())
+    # lambda_stmt caches the built statement by code location, so repeat calls
+    # skip constructing the expression and only bind the new user_id
+    user_id = current_user.id
+    recent_txns = db.session.execute(lambda_stmt(
+        lambda: select(
+            FinancialTransaction.id,
+            FinancialTransaction.type,
+            FinancialTransaction.amount,
+            FinancialTransaction.balance_after,
+            FinancialTransaction.note,
+            FinancialTransaction.created_at,
+        )
+        .where(FinancialTransaction.user_id == user_id)
+        .order_by(FinancialTransaction.created_at.desc())
+        .limit(10)
+    )).all()
+
+    methods = db.session.execute(lambda_stmt(
+        lambda: select(PaymentMethod)
+        .where(PaymentMethod.user_id == user_id)
+        .order_by(PaymentMethod.is_default.desc(), PaymentMethod.created_at.desc())
+    )).scalars().all()
 
     return jsonify({
         "cash": round(float(current_user.funds or 0), 2),
@@ -693,24 +1173,25 @@ def api_funds():
 
 
 @app.route("/api/funds/deposit", methods=["POST"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_deposit_funds():
     data = get_json()
     amount = data.get("amount")
     payment_method_id = data.get("payment_method_id")
 
-    try:
-        amount = float(amount)
-    except Exception:
+    amount = parse_number(amount)
+    if amount is None:
         return jsonify({"error": "INVALID_AMOUNT"}), 400
 
     if amount <= 0:
         return jsonify({"error": "AMOUNT_MUST_BE_POSITIVE"}), 400
 
+    if amount > MAX_FUNDS:
+        return jsonify({"error": "INVALID_AMOUNT"}), 400
+
     if payment_method_id:
-        try:
-            payment_method_id = int(payment_method_id)
-        except Exception:
+        payment_method_id = parse_number(payment_method_id, int)
+        if payment_method_id is None:
             return jsonify({"error": "INVALID_PAYMENT_METHOD"}), 400
 
         pm = PaymentMethod.query.filter_by(
@@ -726,7 +1207,9 @@ def api_deposit_funds():
     if not pm:
         return jsonify({"error": "NO_PAYMENT_METHOD"}), 400
 
-    current_user.funds = round(float(current_user.funds or 0) + amount, 2)
+    if not _credit_funds(current_user, amount):
+        db.session.rollback()
+        return jsonify({"error": "BALANCE_LIMIT_EXCEEDED"}), 400
     record_txn(current_user.id, "DEPOSIT", amount, current_user.funds,
                note=f"Deposit via {pm.brand} ••••{pm.last4}")
 
@@ -739,24 +1222,25 @@ def api_deposit_funds():
 
 
 @app.route("/api/funds/withdraw", methods=["POST"])
-@customer_required
+@role_required(Role.CUSTOMER)
 def api_withdraw_funds():
     data = get_json()
     amount = data.get("amount")
 
-    try:
-        amount = float(amount)
-    except Exception:
+    amount = parse_number(amount)
+    if amount is None:
         return jsonify({"error": "INVALID_AMOUNT"}), 400
 
     if amount <= 0:
         return jsonify({"error": "AMOUNT_MUST_BE_POSITIVE"}), 400
 
-    cash = float(current_user.funds or 0)
-    if amount > cash:
+    if amount > MAX_FUNDS:
+        return jsonify({"error": "INVALID_AMOUNT"}), 400
+
+    if not _debit_funds(current_user, amount):
+        db.session.rollback()
         return jsonify({"error": "INSUFFICIENT_FUNDS"}), 400
 
-    current_user.funds = round(cash - amount, 2)
     record_txn(current_user.id, "WITHDRAW", amount, current_user.funds, note="User withdrawal")
 
     db.session.commit()
@@ -771,7 +1255,7 @@ def api_market_status():
     return jsonify(market_status()), 200
 
 @app.route("/api/admin/market/toggle", methods=["POST"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_market_toggle():
     settings = MarketSettings.query.first()
     if not settings:
@@ -791,21 +1275,12 @@ def api_admin_market_toggle():
     }), 200
 
 @app.route("/api/admin/stocks", methods=["GET"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_stocks():
-    stocks = Stock.query.all()
-    return jsonify([
-        {
-            "id": s.id,
-            "company_name": s.company_name,
-            "symbol": s.symbol,
-            "price": s.price,
-            "volume": s.volume
-        } for s in stocks
-    ]), 200
+    return stocks_response()
 
 @app.route("/api/admin/stocks", methods=["POST"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_create_stock():
     data = request.get_json(silent=True) or {}
 
@@ -817,10 +1292,9 @@ def api_admin_create_stock():
     if not company_name or not symbol or price is None or volume is None:
         return jsonify({"error": "MISSING_FIELDS"}), 400
 
-    try:
-        price = float(price)
-        volume = float(volume)
-    except Exception:
+    price = parse_number(price)
+    volume = parse_number(volume)
+    if price is None or volume is None:
         return jsonify({"error": "INVALID_NUMBER"}), 400
 
     if price <= 0 or volume < 0:
@@ -832,6 +1306,7 @@ def api_admin_create_stock():
     s = Stock(company_name=company_name, symbol=symbol, price=price, volume=volume)
     db.session.add(s)
     db.session.commit()
+    refresh_stocks_cache()
 
     return jsonify({
         "message": "CREATED",
@@ -846,15 +1321,16 @@ def api_admin_create_stock():
 
 
 @app.route("/api/admin/stocks/<int:stock_id>", methods=["DELETE"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_delete_stock(stock_id):
-    s = Stock.query.get_or_404(stock_id)
+    s = db.get_or_404(Stock, stock_id)
     db.session.delete(s)
     db.session.commit()
+    refresh_stocks_cache()
     return jsonify({"message": "DELETED"}), 200
 
 @app.route("/api/admin/market/hours", methods=["POST"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_market_set_hours():
     data = request.get_json(silent=True) or {}
     open_time = data.get("open_time")  # "HH:MM"
@@ -886,7 +1362,7 @@ def api_admin_market_set_hours():
     }), 200
 
 @app.route("/api/admin/market/closed-dates", methods=["POST"])
-@admin_required
+@role_required(Role.ADMIN)
 def api_admin_market_set_closed_dates():
     data = request.get_json(silent=True) or {}
     dates = data.get("dates")  # ["YYYY-MM-DD", ...]
@@ -917,5 +1393,6 @@ def api_admin_market_set_closed_dates():
         "closed_dates": settings.closed_dates
     }), 200
 
+# Local development only; production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == "__main__":
     app.run(debug=True)
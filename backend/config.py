@@ -15,3 +15,29 @@ SQLALCHEMY_DATABASE_URI = (
 )
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Keep warm connections around between requests and transparently replace
+# ones MySQL has dropped after wait_timeout.
+#
+# Every process gets its own pool: each gunicorn worker plus price_updater.py.
+# Peak connections = (workers + 1) * (pool_size + max_overflow), which has to
+# stay under MySQL's max_connections (151 by default) with room for admin
+# sessions. The defaults give (4 + 1) * (10 + 10) = 100.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "pool_use_lifo": True,
+}
+
+# Optional shared cache (e.g. redis://localhost:6379/0); empty disables it
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Development aid: warn when a request runs more SQL statements than this; 0 disables
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "0"))
+
+# Number of reverse proxies / load balancers in front of gunicorn. When set,
+# the client IP (used by the per-IP login limit) is taken from X-Forwarded-For
+# instead of the proxy's own address; 0 means gunicorn faces clients directly.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
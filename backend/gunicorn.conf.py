@@ -0,0 +1,15 @@
+import os
+
+# Production entrypoint: gunicorn -c gunicorn.conf.py app:app
+# Routes spend most of their time waiting on MySQL, so gevent workers let each
+# process interleave many requests. The gevent worker monkey-patches the
+# stdlib before app.py is imported (keep preload_app off), and PyMySQL is
+# pure Python, so its socket IO yields to other greenlets.
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = "gevent"
+# Each worker owns a full SQLAlchemy pool, so the worker count multiplies the
+# MySQL connection budget (see SQLALCHEMY_ENGINE_OPTIONS in config.py). Raise
+# it together with max_connections, not with the core count.
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+preload_app = False
@@ -0,0 +1,56 @@
+-- Brings a database created by an earlier version of app.py up to the current
+-- models. db.create_all() only creates missing tables; it never alters
+-- existing ones, so run this once against an existing database:
+--
+--   mysql -u <user> -p <db_name> < migrations/001_trading_schema.sql
+--
+-- Fresh databases get all of this from db.create_all() and can skip it.
+-- MySQL 8.0.16+ is needed for the CHECK constraint to be enforced.
+
+-- ---------------- user ---------------- --
+-- Exact money column. NULL balances become 0, and ADD CONSTRAINT fails if any
+-- balance is negative. Inspect first:
+--   SELECT id, funds FROM `user` WHERE funds < 0;
+UPDATE `user` SET funds = 0 WHERE funds IS NULL;
+ALTER TABLE `user`
+    MODIFY funds DECIMAL(14, 2) NOT NULL,
+    ADD CONSTRAINT ck_user_funds_nonneg CHECK (funds >= 0);
+
+CREATE INDEX ix_user_role ON `user` (role);
+
+-- ---------------- portfolio ---------------- --
+-- The buy path upserts on (user_id, stock_id), so duplicate holdings have to
+-- be folded into one row per pair before the key can be added.
+UPDATE portfolio p
+JOIN (
+    SELECT MIN(id) AS keep_id, SUM(quantity) AS total
+    FROM portfolio
+    GROUP BY user_id, stock_id
+    HAVING COUNT(*) > 1
+) d ON p.id = d.keep_id
+SET p.quantity = d.total;
+
+DELETE p FROM portfolio p
+JOIN portfolio k
+  ON k.user_id = p.user_id AND k.stock_id = p.stock_id AND k.id < p.id;
+
+ALTER TABLE portfolio
+    ADD CONSTRAINT uq_portfolio_user_stock UNIQUE (user_id, stock_id);
+
+-- ---------------- financial_transaction ---------------- --
+-- Covering index for the /api/funds history. If a previous deploy created the
+-- two-column ix_financial_transaction_user_created, drop it afterwards; the
+-- new index's prefix serves the same lookups:
+--   DROP INDEX ix_financial_transaction_user_created ON financial_transaction;
+CREATE INDEX ix_financial_transaction_user_history
+    ON financial_transaction (user_id, created_at, type, amount, balance_after, note);
+
+-- ---------------- payment_method ---------------- --
+CREATE INDEX ix_payment_method_user_default
+    ON payment_method (user_id, is_default, created_at);
+
+-- ---------------- trade_order ---------------- --
+-- The composite index also backs the user_id foreign key, so the old
+-- single-column index can go once it exists.
+CREATE INDEX ix_trade_order_user_created ON trade_order (user_id, created_at);
+DROP INDEX ix_trade_order_user_id ON trade_order;
@@ -0,0 +1,36 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+from app import update_all_stock_prices, redis_client, PRICE_UPDATE_INTERVAL
+import redis
+
+# Price ticks run in this standalone process instead of inside the web app, so
+# N gunicorn workers don't each start a scheduler and repeat the same UPDATE.
+# Run it alongside the API: python price_updater.py
+
+TICK_LOCK_KEY = "price_updater:tick"
+
+def tick():
+    # With Redis configured, extra replicas of this process are harmless: the
+    # first one to claim the tick runs it and the rest skip until it expires.
+    if redis_client is not None:
+        try:
+            claimed = redis_client.set(TICK_LOCK_KEY, 1, nx=True,
+                                       ex=max(PRICE_UPDATE_INTERVAL - 1, 1))
+        except redis.RedisError:
+            claimed = True  # no coordination available; tick locally
+        if not claimed:
+            return
+    update_all_stock_prices()
+
+def main():
+    scheduler = BlockingScheduler()
+    scheduler.add_job(
+        func=tick,
+        trigger="interval",
+        seconds=PRICE_UPDATE_INTERVAL,
+        max_instances=1,
+        coalesce=True
+    )
+    scheduler.start()
+
+if __name__ == "__main__":
+    main()
@@ -47,7 +47,7 @@ function App() {
 
   async function loadOrders() {
     const data = await tradingApi.orders();
-    setOrders(data);
+    setOrders(data.orders);
   }
 
   async function loadPortfolio() {
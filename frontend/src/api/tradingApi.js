@@ -25,7 +25,8 @@ export const tradingApi = {
 
   // ---- read data ----
   stocks: () => fetchJSON("/api/stocks"),
-  orders: () => fetchJSON("/api/orders"),
+  orders: (before = null) =>
+    fetchJSON(before ? `/api/orders?before=${encodeURIComponent(before)}` : "/api/orders"),
   portfolio: () => fetchJSON("/api/portfolio"),
   funds: () => fetchJSON("/api/funds"),
   marketStatus: () => fetchJSON("/api/market/status"),
@@ -3,20 +3,34 @@ import { tradingApi } from "../api/tradingApi";
 
 export default function TransactionsPage() {
   const [orders, setOrders] = useState([]);
+  const [nextBefore, setNextBefore] = useState(null);
   const [error, setError] = useState("");
   const [notice, setNotice] = useState("");
 
+  // Show only BUY/SELL orders (they should already be only BUY/SELL, but filtering is safe)
+  function onlyStockOrders(data) {
+    return (data.orders || []).filter(
+      (o) => o.side === "BUY" || o.side === "SELL"
+    );
+  }
+
   async function load() {
     setError("");
     try {
       const data = await tradingApi.orders();
+      setOrders(onlyStockOrders(data));
+      setNextBefore(data.next_before);
+    } catch (e) {
+      setError(e.message);
+    }
+  }
 
-      // Show only BUY/SELL orders (they should already be only BUY/SELL, but filtering is safe)
-      const onlyStockOrders = (data || []).filter(
-        (o) => o.side === "BUY" || o.side === "SELL"
-      );
-
-      setOrders(onlyStockOrders);
+  async function loadMore() {
+    setError("");
+    try {
+      const data = await tradingApi.orders(nextBefore);
+      setOrders((prev) => [...prev, ...onlyStockOrders(data)]);
+      setNextBefore(data.next_before);
     } catch (e) {
       setError(e.message);
     }
@@ -112,6 +126,11 @@ export default function TransactionsPage() {
             </tbody>
           </table>
         )}
+        {nextBefore && (
+          <button className="btn" style={{ marginTop: 12 }} onClick={loadMore}>
+            Load more
+          </button>
+        )}
       </div>
 
       <p className="muted" style={{ marginTop: 14 }}>